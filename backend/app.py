@@ -4,14 +4,38 @@ Demucs v4 Vocal Separation Service
 High-accuracy vocal stem extraction for pitch analysis
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
+from werkzeug.utils import secure_filename
+import hashlib
+import io
 import tempfile
 import os
-import subprocess
 import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import shutil
+
+import soundfile as sf
+import torch
+import torchaudio
+from demucs.apply import apply_model
+from demucs.audio import convert_audio
+
+try:
+    import lameenc
+except ImportError:
+    lameenc = None  # fall back to torchaudio's encoder
+
+try:
+    from torchaudio.io import CodecConfig
+except ImportError:
+    CodecConfig = None  # torchaudio < 2.1
+
+from gpu_pool import GpuWorker
+from model_loading import load_demucs_model
+from vectorized import apply_vectorized, CudaGraphRunner
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend
@@ -24,17 +48,333 @@ logger = logging.getLogger(__name__)
 UPLOAD_FOLDER = tempfile.mkdtemp()
 DEMUCS_MODEL = "htdemucs"  # Stable model that works with newer PyTorch
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB max file size
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+N_GPUS = torch.cuda.device_count()
+MULTI_GPU = N_GPUS > 1
+
+if DEVICE == "cuda":
+    # Segment shapes are fixed, so cuDNN autotuning pays for itself on
+    # the first batch; TF32 uses tensor cores for any remaining fp32
+    # matmuls on Ampere+
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+BATCH_SIZE = int(os.environ.get("DEMUCS_BATCH_SIZE", 4))  # max requests per GPU batch
+MAX_WAIT_MS = int(os.environ.get("DEMUCS_MAX_WAIT_MS", 50))  # batching window
+GPU_BATCH = int(os.environ.get("DEMUCS_GPU_BATCH", 8))  # segments per forward pass
+JOB_TIMEOUT_S = int(os.environ.get("DEMUCS_TIMEOUT_S", 600))  # same cap as the old CLI timeout
+USE_FP16 = os.environ.get("USE_FP16", "1") != "0"  # set USE_FP16=0 for fp32 A/B
+USE_CUDA_GRAPHS = os.environ.get("USE_CUDA_GRAPHS", "0") != "0"  # opt-in
+USE_INT8 = os.environ.get("USE_INT8", "0") != "0"  # CPU-only, opt-in
+CACHE_DIR = Path(os.environ.get(
+    "DEMUCS_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "karaoketones-vocal-cache")))
+MAX_CACHE_MB = int(os.environ.get("DEMUCS_MAX_CACHE_MB", 2048))
+# Nginx internal location mapped to CACHE_DIR, e.g. /internal/vocals;
+# when set, cached MP3s go out via kernel sendfile instead of Python
+X_ACCEL_PREFIX = os.environ.get("X_ACCEL_PREFIX")
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+SCRATCH_POOL_SIZE = int(os.environ.get("DEMUCS_SCRATCH_POOL", 8))
+
+# Fixed pool of scratch paths for the decode fallback, recycled through a
+# queue. Reusing the same inodes (open "wb" truncates in place) avoids
+# the per-request create/unlink churn of fresh temp files.
+SCRATCH_Q = queue.Queue()
+for _i in range(SCRATCH_POOL_SIZE):
+    SCRATCH_Q.put(os.path.join(UPLOAD_FOLDER, f"scratch_{_i}"))
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
-def cleanup_temp_files(folder_path):
-    """Clean up temporary files"""
+# Load the model once at startup instead of shelling out to
+# `python -m demucs.separate` per request. The subprocess paid full
+# interpreter startup + weight deserialization (hundreds of MB) on every
+# call; in-process we pay it exactly once.
+logger.info(f"Loading Demucs model '{DEMUCS_MODEL}' on {DEVICE}...")
+MODEL = load_demucs_model(DEMUCS_MODEL)
+if MULTI_GPU:
+    # Each GPU worker process loads its own CUDA copy; the parent keeps
+    # this one on CPU for metadata (samplerate, sources) and encoding
+    pass
+else:
+    MODEL.to(DEVICE)
+    if DEVICE == "cuda":
+        # NHWC layout lets cuDNN pick tensor-core kernels for the 2-D
+        # convs in the spectral branch; only 4-D weights are affected,
+        # the 1-D time branch stays as-is
+        MODEL.to(memory_format=torch.channels_last)
+    if USE_FP16 and DEVICE == "cuda":
+        # Halves the weight bytes pulled through HBM per forward and doubles
+        # tensor-core throughput; apply_vectorized casts inputs to match
+        MODEL.to(dtype=torch.float16)
+    if USE_INT8 and DEVICE == "cpu":
+        # Dynamic int8 for the Linear/LSTM layers: 4x less weight
+        # bandwidth and VNNI int8 dot products on recent x86. Convs stay
+        # fp32; minor SDR cost, hence opt-in.
+        from torch.ao.quantization import quantize_dynamic
+        MODEL = quantize_dynamic(MODEL, {torch.nn.Linear, torch.nn.LSTM},
+                                 dtype=torch.qint8)
+MODEL.eval()
+VOCALS_IDX = MODEL.sources.index("vocals")
+# Segment shapes are fixed, so the forward passes can be replayed as
+# captured CUDA graphs (per raw sub-model) to skip per-kernel launch
+# overhead
+GRAPH_RUNNER = (CudaGraphRunner()
+                if USE_CUDA_GRAPHS and DEVICE == "cuda" and not MULTI_GPU
+                else None)
+logger.info(f"Model loaded (sources: {MODEL.sources})")
+
+class InferenceJob:
+    """A single upload waiting for the batching worker"""
+
+    def __init__(self, wav_future):
+        self.wav_future = wav_future
+        self.wav = None
+        self.mean = 0.0
+        self.std = 1.0
+        self.stems = None
+        self.error = None
+        self.done = threading.Event()
+
+    def result(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError("Vocal separation timed out")
+        if self.error is not None:
+            raise self.error
+        return self.stems
+
+INFERENCE_QUEUE = queue.Queue()
+
+# Decode uploads off the request thread so the next batch's audio is
+# already in memory when the GPU finishes the current one
+DECODE_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="audio-decode")
+
+def _decode_and_convert(raw):
+    wav, sr = decode_audio(raw)
+    return convert_audio(wav, sr, MODEL.samplerate, MODEL.audio_channels)
+
+def _run_batch_local(batch):
+    """Run one stacked (B, C, T) batch on this process's device"""
+    if DEVICE == "cuda":
+        # Batch the overlapping segments themselves instead of
+        # letting apply_model walk them sequentially
+        return apply_vectorized(MODEL, batch, max_sz=GPU_BATCH,
+                                forward=GRAPH_RUNNER)
+    elif USE_FP16 and not USE_INT8:
+        # bf16 autocast on CPU; weights stay fp32 (skipped under int8
+        # quantization, whose kernels don't mix with autocast)
+        with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16):
+            stems = apply_model(MODEL, batch, device=DEVICE, progress=False)
+        return stems.float()
+    else:
+        with torch.no_grad():
+            return apply_model(MODEL, batch, device=DEVICE, progress=False)
+
+def _inference_worker(run_batch):
+    """
+    Batch concurrent requests into a single model call.
+
+    Pulls the first pending job, then waits up to MAX_WAIT_MS for more
+    (up to BATCH_SIZE total), right-pads everything to a common length,
+    and runs one batched forward. One big conv/GEMM per batch instead of
+    N separate kernel launch sequences keeps the GPU full under
+    concurrent load. With multiple GPUs, one dispatcher thread per
+    device pulls from the shared queue so batches shard across workers.
+    """
+    while True:
+        jobs = [INFERENCE_QUEUE.get()]
+        while len(jobs) < BATCH_SIZE:
+            try:
+                jobs.append(INFERENCE_QUEUE.get(timeout=MAX_WAIT_MS / 1000.0))
+            except queue.Empty:
+                break
+
+        # Resolve the prefetched decodes; a bad upload only fails its
+        # own job, not the whole batch
+        resolved = []
+        for job in jobs:
+            try:
+                job.wav = job.wav_future.result()
+                resolved.append(job)
+            except Exception as e:
+                job.error = e
+                job.done.set()
+        jobs = resolved
+        if not jobs:
+            continue
+
+        try:
+            # Same per-track normalization the demucs CLI applies around
+            # apply_model: center/scale by the mono reference, undo on
+            # the outputs. Done per item, not on the padded batch.
+            for job in jobs:
+                ref = job.wav.mean(0)
+                job.mean = ref.mean().item()
+                job.std = ref.std().item() + 1e-8
+            lengths = [job.wav.shape[-1] for job in jobs]
+            max_len = max(lengths)
+            batch = torch.stack([
+                torch.nn.functional.pad(
+                    (job.wav - job.mean) / job.std,
+                    (0, max_len - job.wav.shape[-1]))
+                for job in jobs
+            ])
+            stems = run_batch(batch)
+            for job, length, out in zip(jobs, lengths, stems):
+                job.stems = out[..., :length] * job.std + job.mean
+                job.done.set()
+        except Exception as e:
+            logger.error(f"Batched inference failed: {e}")
+            for job in jobs:
+                job.error = e
+                job.done.set()
+
+if MULTI_GPU:
+    logger.info(f"Sharding requests across {N_GPUS} GPUs")
+    for gpu_idx in range(N_GPUS):
+        worker = GpuWorker(gpu_idx, DEMUCS_MODEL, USE_FP16, GPU_BATCH,
+                           timeout=JOB_TIMEOUT_S)
+        threading.Thread(target=_inference_worker, args=(worker.run_batch,),
+                         daemon=True,
+                         name=f"demucs-dispatch-{gpu_idx}").start()
+else:
+    threading.Thread(target=_inference_worker, args=(_run_batch_local,),
+                     daemon=True, name="demucs-batch-worker").start()
+
+def _sniff_format(raw):
+    """Best-effort compressed-container detection from magic bytes"""
+    if raw[:3] == b"ID3" or (len(raw) > 1
+                             and raw[0] == 0xFF and (raw[1] & 0xE0) == 0xE0):
+        return "mp3"
+    if raw[:4] == b"fLaC":
+        return "flac"
+    if raw[:4] == b"OggS":
+        return "ogg"
+    if raw[4:8] == b"ftyp":
+        return "mp4"
+    return None
+
+def decode_audio(raw):
+    """Decode uploaded audio bytes in memory to ((channels, samples), rate)"""
+    fmt = _sniff_format(raw)
+    if fmt is not None:
+        # Compressed upload (mp3/flac/ogg/m4a): hand the bytes straight
+        # to torchaudio's backend, no WAV intermediate anywhere
+        try:
+            return torchaudio.load(io.BytesIO(raw), format=fmt)
+        except Exception:
+            pass  # fall through to the generic paths below
     try:
-        if os.path.exists(folder_path):
-            shutil.rmtree(folder_path)
-    except Exception as e:
-        logger.warning(f"Failed to cleanup {folder_path}: {e}")
+        data, sr = sf.read(io.BytesIO(raw), dtype="float32", always_2d=True)
+        return torch.from_numpy(data.T).contiguous(), sr
+    except Exception:
+        # libsndfile can't read every container (e.g. m4a); fall back to
+        # torchaudio via a pooled scratch file
+        tmp_path = SCRATCH_Q.get()
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(raw)
+            return torchaudio.load(tmp_path)
+        finally:
+            SCRATCH_Q.put(tmp_path)
+
+def encode_mp3(wav):
+    """Encode a (channels, samples) tensor to an in-memory MP3 buffer"""
+    if lameenc is not None:
+        # In-process LAME: feed interleaved int16 PCM straight to the
+        # encoder, no intermediate file
+        pcm = (wav.clamp(-1, 1) * 32767).to(torch.int16)
+        pcm = pcm.T.contiguous().numpy().tobytes()
+        enc = lameenc.Encoder()
+        enc.set_bit_rate(192)
+        enc.set_in_sample_rate(MODEL.samplerate)
+        enc.set_channels(wav.shape[0])
+        enc.set_quality(5)
+        enc.silence()
+        return io.BytesIO(enc.encode(pcm) + enc.flush())
+    buf = io.BytesIO()
+    if CodecConfig is not None:
+        # torchaudio >= 2.1 dispatches file-like mp3 saves to the ffmpeg
+        # backend, whose compression argument is a CodecConfig
+        torchaudio.save(buf, wav, MODEL.samplerate, format="mp3",
+                        compression=CodecConfig(bit_rate=192000))
+    else:
+        torchaudio.save(buf, wav, MODEL.samplerate, format="mp3",
+                        compression=192)
+    buf.seek(0)
+    return buf
+
+def cache_path_for(raw):
+    """Content-addressed cache path for an upload's vocal MP3"""
+    key = hashlib.sha256(raw).hexdigest()
+    return CACHE_DIR / f"{key}.mp3"
+
+# Running cache size so the eviction scan only runs when the cap can
+# actually be exceeded; while under it, stores skip the scandir entirely
+_cache_lock = threading.Lock()
+_cache_size = sum(e.stat().st_size for e in os.scandir(CACHE_DIR))
+
+def cache_store(path, buf):
+    """Store an encoded MP3 buffer in the cache, evicting LRU if over cap"""
+    global _cache_size
+    try:
+        path.write_bytes(buf.getbuffer())
+        limit = MAX_CACHE_MB * 1024 * 1024
+        with _cache_lock:
+            _cache_size += buf.getbuffer().nbytes
+            if _cache_size <= limit:
+                return
+            # Over cap: rebuild the true size from disk, then evict
+            # least-recently-read first (atime updated by cache hits)
+            entries = [(e.stat(), e.path) for e in os.scandir(CACHE_DIR)]
+            _cache_size = sum(st.st_size for st, _ in entries)
+            for st, entry_path in sorted(entries, key=lambda t: t[0].st_atime):
+                if _cache_size <= limit:
+                    break
+                os.unlink(entry_path)
+                _cache_size -= st.st_size
+    except OSError as e:
+        logger.warning(f"Cache store failed: {e}")
+
+def send_mp3(download_name, cache_path=None, buf=None):
+    """
+    Build the MP3 response. For on-disk results behind nginx, an
+    X-Accel-Redirect hands the file path back so the body is streamed
+    with kernel sendfile rather than chunked reads through Python.
+    """
+    if cache_path is not None and cache_path.exists():
+        if X_ACCEL_PREFIX:
+            # download_name carries the client-supplied upload filename;
+            # the send_file branches sanitize it via werkzeug, so this
+            # hand-built header must too (quotes/CRLF would mangle it)
+            safe_name = secure_filename(download_name) or "vocals.mp3"
+            return Response(
+                mimetype='audio/mpeg',
+                headers={
+                    "X-Accel-Redirect": f"{X_ACCEL_PREFIX}/{cache_path.name}",
+                    "Content-Disposition":
+                        f'attachment; filename="{safe_name}"',
+                })
+        return send_file(
+            cache_path,
+            mimetype='audio/mpeg',
+            as_attachment=True,
+            download_name=download_name
+        )
+    return send_file(
+        buf,
+        mimetype='audio/mpeg',
+        as_attachment=True,
+        download_name=download_name
+    )
+
+def separate_stems(raw):
+    """Run Demucs on uploaded audio bytes, return (stems tensor, mix wav)"""
+    # Decode starts on the pool immediately; the batching worker picks
+    # up the finished tensor when it assembles the next batch
+    job = InferenceJob(DECODE_POOL.submit(_decode_and_convert, raw))
+    INFERENCE_QUEUE.put(job)
+    return job.result(timeout=JOB_TIMEOUT_S), job.wav
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -42,7 +382,8 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "service": "demucs-vocal-separation",
-        "model": DEMUCS_MODEL
+        "model": DEMUCS_MODEL,
+        "device": DEVICE
     })
 
 @app.route('/separate-vocals', methods=['POST'])
@@ -58,155 +399,57 @@ def separate_vocals():
     if file.filename == '':
         return jsonify({"error": "No file selected"}), 400
 
-    # Create temporary directories
-    input_dir = tempfile.mkdtemp()
-    output_dir = tempfile.mkdtemp()
-
     try:
-        # Save uploaded file with safe name
-        safe_filename = "input_audio.wav"
-        input_path = os.path.join(input_dir, safe_filename)
-        file.save(input_path)
-
-        logger.info(f"Processing audio file: {file.filename}")
-        logger.info(f"Saved as: {safe_filename}")
-        logger.info(f"File size: {os.path.getsize(input_path)} bytes")
+        # Keep everything in memory: no input save, no output read-back
+        raw = file.stream.read()
+        logger.info(f"Processing audio file: {file.filename} ({len(raw)} bytes)")
+
+        # Karaoke users re-run the same backing tracks; a content-hash
+        # hit skips the GPU entirely
+        cache_path = cache_path_for(raw)
+        if cache_path.exists():
+            logger.info(f"Cache hit: {cache_path.name}")
+            return send_mp3(f"vocals_{file.filename}.mp3",
+                            cache_path=cache_path)
 
         # Try Demucs separation with fallback to original audio
+        separated = True
         try:
-            cmd = [
-                "python", "-m", "demucs.separate",
-                "-n", DEMUCS_MODEL,
-                "-o", output_dir,
-                "--filename", "{track}/{stem}.{ext}",
-                "--mp3",
-                "--mp3-bitrate", "192",
-                "--two-stems", "vocals",  # Only separate vocals vs no_vocals
-                input_path
-            ]
-
-            logger.info(f"Running Demucs: {' '.join(cmd)}")
-
-            # Execute Demucs with timeout and better error handling
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=600,  # 10 minute timeout
-                encoding='utf-8',
-                errors='replace'  # Handle encoding issues
-            )
-
-            if result.returncode != 0:
-                logger.error(f"Demucs failed with return code: {result.returncode}")
-                logger.error(f"Stderr: {result.stderr}")
-                logger.warning("Falling back to original audio due to Demucs compatibility issue")
-
-                # Create fallback by copying original audio as "vocals"
-                fallback_dir = os.path.join(output_dir, "fallback")
-                os.makedirs(fallback_dir, exist_ok=True)
-                fallback_path = os.path.join(fallback_dir, "vocals.mp3")
-
-                # Convert original WAV to MP3 for consistency
-                import shutil
-                shutil.copy2(input_path, fallback_path.replace('.mp3', '.wav'))
-
-                # Convert to MP3 using simple method
-                try:
-                    import subprocess
-                    convert_cmd = [
-                        "python", "-c",
-                        f"import torchaudio; import torch; wav, sr = torchaudio.load('{fallback_path.replace('.mp3', '.wav')}'); torchaudio.save('{fallback_path}', wav, sr, format='mp3')"
-                    ]
-                    subprocess.run(convert_cmd, check=True, capture_output=True)
-                    os.remove(fallback_path.replace('.mp3', '.wav'))
-                except:
-                    # If conversion fails, just rename the wav file
-                    os.rename(fallback_path.replace('.mp3', '.wav'), fallback_path.replace('.mp3', '_original.wav'))
-                    fallback_path = fallback_path.replace('.mp3', '_original.wav')
-
-                vocal_file = fallback_path
-                logger.info(f"Created fallback vocal file: {vocal_file}")
-            else:
-                # Demucs succeeded, need to find the vocal file
-                vocal_file = None
-
+            stems, wav = separate_stems(raw)
+            vocals = stems[VOCALS_IDX]
+        except TimeoutError:
+            logger.error("Demucs processing timeout")
+            return jsonify({"error": "Processing timeout - file too large"}), 408
         except Exception as e:
-            logger.error(f"Demucs execution failed: {str(e)}")
-            return jsonify({
-                "error": "Vocal separation failed",
-                "details": str(e),
-                "note": "This may be due to PyTorch 2.8 compatibility issues with Demucs"
-            }), 500
-
-        # Find the vocal stem file with better debugging (only if not already set by fallback)
-        if vocal_file is None:
-            logger.info(f"Searching for vocal files in: {output_dir}")
-
-            # List all files created by Demucs
-            all_files = []
-            for root, dirs, files in os.walk(output_dir):
-                logger.info(f"Directory: {root}")
-                logger.info(f"Subdirs: {dirs}")
-                logger.info(f"Files: {files}")
-
-                for file_name in files:
-                    full_path = os.path.join(root, file_name)
-                    all_files.append(full_path)
-                    logger.info(f"Found file: {full_path}")
-
-                    # Look for vocals file (could be .mp3 or .wav)
-                    if "vocals" in file_name.lower() and (file_name.endswith('.mp3') or file_name.endswith('.wav')):
-                        vocal_file = full_path
-                        logger.info(f"Found vocal file: {vocal_file}")
-                        break
-
-                if vocal_file:
-                    break
-
-        if not vocal_file:
-            logger.error(f"No vocal file found. All files created: {all_files}")
-            # Try to find any audio file as fallback
-            for f in all_files:
-                if f.endswith('.mp3') or f.endswith('.wav'):
-                    logger.info(f"Using fallback audio file: {f}")
-                    vocal_file = f
-                    break
-
-        if not vocal_file or not os.path.exists(vocal_file):
-            logger.error(f"Vocal stem file not found. Searched in: {output_dir}")
-            logger.error(f"All files found: {all_files}")
-            return jsonify({"error": "Vocal stem extraction failed"}), 500
-
-        logger.info(f"Vocal separation successful: {vocal_file}")
-        logger.info(f"Vocal file size: {os.path.getsize(vocal_file)} bytes")
-
-        # Return the vocal stem file
-        response = send_file(
-            vocal_file,
-            mimetype='audio/mpeg',
-            as_attachment=True,
-            download_name=f"vocals_{file.filename}.mp3"
-        )
-
-        # Schedule cleanup after response is sent
-        @response.call_on_close
-        def cleanup():
-            cleanup_temp_files(input_dir)
-            cleanup_temp_files(output_dir)
-
-        return response
-
-    except subprocess.TimeoutExpired:
-        logger.error("Demucs processing timeout")
-        cleanup_temp_files(input_dir)
-        cleanup_temp_files(output_dir)
-        return jsonify({"error": "Processing timeout - file too large"}), 408
+            logger.error(f"Demucs inference failed: {str(e)}")
+            logger.warning("Falling back to original audio")
+            # Fall back to returning the original audio as "vocals" so the
+            # frontend can still run pitch analysis on something
+            separated = False
+            try:
+                wav, sr = decode_audio(raw)
+                vocals = convert_audio(wav, sr, MODEL.samplerate,
+                                       MODEL.audio_channels)
+            except Exception:
+                return jsonify({
+                    "error": "Vocal separation failed",
+                    "details": str(e)
+                }), 500
+
+        buf = encode_mp3(vocals)
+        logger.info(f"Vocal separation successful "
+                    f"({buf.getbuffer().nbytes} bytes of MP3)")
+
+        # Only cache real separations, never the fallback passthrough
+        if separated:
+            cache_store(cache_path, buf)
+
+        return send_mp3(f"vocals_{file.filename}.mp3",
+                        cache_path=cache_path if separated else None,
+                        buf=buf)
 
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
-        cleanup_temp_files(input_dir)
-        cleanup_temp_files(output_dir)
         return jsonify({
             "error": "Internal server error",
             "details": str(e)
@@ -225,47 +468,19 @@ def analyze_vocals():
     if file.filename == '':
         return jsonify({"error": "No file selected"}), 400
 
-    input_dir = tempfile.mkdtemp()
-    output_dir = tempfile.mkdtemp()
-
     try:
-        # Save uploaded file
-        input_path = os.path.join(input_dir, "input_audio.wav")
-        file.save(input_path)
-
-        # Get input file info
-        input_size = os.path.getsize(input_path)
-
-        # Run Demucs separation
-        cmd = [
-            "python", "-m", "demucs.separate",
-            "-n", DEMUCS_MODEL,  # Use -n flag instead of --model
-            "-o", output_dir,
-            "--filename", "{track}/{stem}.{ext}",
-            "--mp3",
-            "--mp3-bitrate", "192",
-            input_path
-        ]
-
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
-
-        if result.returncode != 0:
-            return jsonify({"error": "Vocal separation failed"}), 500
-
-        # Find output files
-        vocal_file = None
-        accompaniment_file = None
-
-        for root, dirs, files in os.walk(output_dir):
-            for file_name in files:
-                if "vocals.mp3" in file_name:
-                    vocal_file = os.path.join(root, file_name)
-                elif "no_vocals.mp3" in file_name:
-                    accompaniment_file = os.path.join(root, file_name)
-
-        # Get file sizes
-        vocal_size = os.path.getsize(vocal_file) if vocal_file else 0
-        accompaniment_size = os.path.getsize(accompaniment_file) if accompaniment_file else 0
+        raw = file.stream.read()
+        input_size = len(raw)
+
+        # Run Demucs separation in-process
+        stems, wav = separate_stems(raw)
+        vocals = stems[VOCALS_IDX]
+        # Two-stems style: accompaniment is just the mix minus the vocal
+        # stem, so we never post-process drums/bass/other individually
+        accompaniment = wav - vocals
+
+        vocal_size = encode_mp3(vocals).getbuffer().nbytes
+        accompaniment_size = encode_mp3(accompaniment).getbuffer().nbytes
 
         analysis_result = {
             "success": True,
@@ -274,29 +489,34 @@ def analyze_vocals():
             "input_size_mb": round(input_size / (1024 * 1024), 2),
             "vocal_size_mb": round(vocal_size / (1024 * 1024), 2),
             "accompaniment_size_mb": round(accompaniment_size / (1024 * 1024), 2),
-            "vocal_extracted": vocal_file is not None,
+            "vocal_extracted": True,
             "processing_time": "completed"
         }
 
-        cleanup_temp_files(input_dir)
-        cleanup_temp_files(output_dir)
-
         return jsonify(analysis_result)
 
+    except TimeoutError:
+        return jsonify({"error": "Processing timeout - file too large"}), 408
+
     except Exception as e:
-        cleanup_temp_files(input_dir)
-        cleanup_temp_files(output_dir)
         return jsonify({
             "error": "Analysis failed",
             "details": str(e)
         }), 500
 
 if __name__ == '__main__':
+    # Dev-only entrypoint. In production run under gunicorn so many
+    # request threads can feed the batching queue concurrently while the
+    # model stays a single copy in VRAM:
+    #   gunicorn -k gthread -w 1 --threads 32 -b 0.0.0.0:5000 app:app
     print(f"""
 Demucs Vocal Separation Service Starting...
 Model: {DEMUCS_MODEL} (Maximum Accuracy)
+Device: {DEVICE}
 Max file size: {MAX_FILE_SIZE // (1024*1024)}MB
 Temp folder: {UPLOAD_FOLDER}
 """)
 
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # debug=True would serialize requests behind the reloader and load
+    # the model twice
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
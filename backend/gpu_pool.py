@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Per-GPU Demucs worker processes
+
+A single Flask process pins one GPU; on a multi-GPU box the others sit
+idle. Each GpuWorker spawns a fresh process that sets
+CUDA_VISIBLE_DEVICES *before* torch initializes CUDA, loads its own copy
+of the model, and serves stacked request batches from a queue. The
+parent keeps one dispatcher thread per worker, so concurrent batches
+shard across all devices.
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import time
+
+def _worker_main(gpu_idx, model_name, use_fp16, max_sz, task_q, result_q):
+    """Entry point for one worker process, pinned to a single GPU"""
+    # Must happen before the torch import below initializes CUDA
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_idx)
+
+    import torch
+    from model_loading import load_demucs_model
+    from vectorized import apply_vectorized, unwrap_bag
+
+    # Same cuDNN autotune + TF32 fast paths as the parent enables
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+
+    try:
+        model = load_demucs_model(model_name)
+        # Named demucs models load as a BagOfModels wrapper; make the
+        # device/layout/dtype moves explicitly target the wrapped
+        # sub-models that actually run
+        for sub_model in unwrap_bag(model)[0]:
+            sub_model.to("cuda")
+            # NHWC for the spectral branch's 2-D convs, as the parent does
+            sub_model.to(memory_format=torch.channels_last)
+            if use_fp16:
+                sub_model.to(dtype=torch.float16)
+        model.eval()
+    except Exception as e:
+        # Tell the parent instead of leaving its startup handshake hanging
+        result_q.put(("load-failed", repr(e)))
+        return
+    result_q.put(("ready", None))
+
+    while True:
+        item = task_q.get()
+        if item is None:
+            break
+        seq, batch = item
+        try:
+            stems = apply_vectorized(model, batch, max_sz=max_sz)
+            result_q.put((seq, stems, None))
+        except Exception as e:
+            result_q.put((seq, None, e))
+
+class GpuWorker:
+    """Handle to one per-GPU worker process, used by one dispatcher thread"""
+
+    def __init__(self, gpu_idx, model_name, use_fp16, max_sz, timeout=600):
+        self.timeout = timeout
+        # spawn (not fork) so CUDA_VISIBLE_DEVICES is set pre-import and
+        # the child doesn't inherit the parent's CUDA context
+        ctx = mp.get_context("spawn")
+        self.task_q = ctx.Queue()
+        self.result_q = ctx.Queue()
+        self.proc = ctx.Process(
+            target=_worker_main,
+            args=(gpu_idx, model_name, use_fp16, max_sz,
+                  self.task_q, self.result_q),
+            daemon=True,
+            name=f"demucs-gpu-{gpu_idx}",
+        )
+        self.proc.start()
+        # Wait for the model load, but notice a worker that died instead
+        while True:
+            try:
+                status, detail = self.result_q.get(timeout=5)
+                break
+            except queue.Empty:
+                if not self.proc.is_alive():
+                    raise RuntimeError(
+                        f"GPU worker {gpu_idx} died during startup "
+                        f"(exit code {self.proc.exitcode})")
+        if status != "ready":
+            raise RuntimeError(f"GPU worker {gpu_idx} failed to load "
+                               f"model: {detail}")
+        self.seq = 0
+
+    def run_batch(self, batch, timeout=None):
+        """Run one (B, C, T) batch on this worker's GPU, return stems"""
+        if timeout is None:
+            timeout = self.timeout
+        self.seq += 1
+        self.task_q.put((self.seq, batch))
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                seq, stems, err = self.result_q.get(timeout=5)
+            except queue.Empty:
+                if not self.proc.is_alive():
+                    raise RuntimeError(
+                        f"GPU worker {self.proc.name} died "
+                        f"(exit code {self.proc.exitcode})")
+                if time.monotonic() > deadline:
+                    raise TimeoutError(
+                        f"GPU worker {self.proc.name} batch timed out")
+                continue
+            if seq != self.seq:
+                continue  # stale result from a batch that already timed out
+            if err is not None:
+                raise err
+            return stems
+
+    def stop(self):
+        self.task_q.put(None)
+        self.proc.join(timeout=5)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Demucs model loading helpers
+
+demucs.pretrained.get_model deserializes the full state dict into heap
+memory before the parameters are copied into the model, so startup
+briefly holds ~2x the weight bytes in host RAM. When a local checkpoint
+is available (DEMUCS_CHECKPOINT, a torch-saved demucs package), load it
+with mmap=True instead: weight pages are faulted in from the page cache
+as they're copied to the device, the heap copy never exists, and
+multiple worker processes loading the same file share the cached pages.
+"""
+
+import os
+
+import torch
+
+def load_demucs_model(model_name):
+    """Load a Demucs model by name, or from DEMUCS_CHECKPOINT if set"""
+    ckpt = os.environ.get("DEMUCS_CHECKPOINT")
+    if ckpt:
+        from demucs.states import load_model
+        # A demucs package pickles the model class and constructor args,
+        # not just tensors, so torch >= 2.6's weights_only default would
+        # refuse it; the checkpoint is an operator-supplied local file,
+        # so the full unpickler is fine here
+        package = torch.load(ckpt, map_location="cpu", mmap=True,
+                             weights_only=False)
+        return load_model(package)
+    from demucs.pretrained import get_model
+    return get_model(model_name)
@@ -11,20 +11,22 @@ import soundfile as sf
 
 def create_test_audio():
     """Create a simple test audio file"""
-    # Generate a simple sine wave
+    # Generate a sine wave with two harmonics, fused into one float32
+    # pass: reuse the phase buffer and accumulate in place instead of
+    # allocating a fresh full-length array per harmonic
     duration = 5  # seconds
     sample_rate = 44100
     frequency = 440  # A4 note
 
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
-    audio = np.sin(2 * np.pi * frequency * t)
-
-    # Add some harmonics to make it more interesting
-    audio += 0.3 * np.sin(2 * np.pi * frequency * 2 * t)
-    audio += 0.1 * np.sin(2 * np.pi * frequency * 3 * t)
+    n = int(sample_rate * duration)
+    phase = np.arange(n, dtype=np.float32)
+    phase *= np.float32(2 * np.pi * frequency / sample_rate)
+    audio = np.sin(phase)
+    audio += 0.3 * np.sin(2 * phase)
+    audio += 0.1 * np.sin(3 * phase)
 
     # Normalize
-    audio = audio / np.max(np.abs(audio)) * 0.7
+    audio *= 0.7 / np.max(np.abs(audio))
 
     return audio, sample_rate
 
@@ -75,11 +77,15 @@ def test_demucs():
         if result.returncode == 0:
             print("SUCCESS: Demucs test successful!")
 
-            # List output files
-            for root, dirs, files in os.walk(output_dir):
-                for file in files:
-                    full_path = os.path.join(root, file)
-                    print(f"Output file: {full_path}")
+            # Demucs output layout is deterministic: <out>/<model>/<track>/<stem>.wav
+            # so check the expected paths instead of scanning the tree
+            track_dir = os.path.join(output_dir, "htdemucs", "test_audio")
+            for stem in ("vocals.wav", "no_vocals.wav"):
+                stem_path = os.path.join(track_dir, stem)
+                if os.path.exists(stem_path):
+                    print(f"Output file: {stem_path}")
+                else:
+                    print(f"WARNING: expected output missing: {stem_path}")
         else:
             print("ERROR: Demucs test failed!")
 
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Smoke tests for the in-process separation pipeline
+
+Run directly or via pytest. The apply_vectorized tests use a toy model
+so they only need torch and run on CPU in a second; the full
+separate_stems test loads the real Demucs model (weights download on
+first run) and only runs with RUN_FULL_SMOKE=1.
+"""
+
+import io
+import os
+
+import numpy as np
+import torch
+
+class ToyModel(torch.nn.Module):
+    """Tiny stand-in exposing the attributes apply_vectorized relies on"""
+
+    sources = ["drums", "bass", "other", "vocals"]
+    samplerate = 100
+    audio_channels = 2
+    segment = 1.0  # toy "seconds" -> segment_length of 100 samples
+
+    def __init__(self):
+        super().__init__()
+        self.scale = torch.nn.Parameter(torch.ones(1))
+
+    def forward(self, mix):
+        # Every "source" is just the input, so the weighted overlap-add
+        # must reconstruct the mix exactly
+        return self.scale * mix[:, None].repeat(1, len(self.sources), 1, 1)
+
+def test_apply_vectorized_shapes():
+    from vectorized import apply_vectorized
+
+    model = ToyModel().eval()
+    mix = torch.randn(2, 350)  # spans several segments, forces padding
+    out = apply_vectorized(model, mix, max_sz=2)
+
+    assert out.shape == (1, len(ToyModel.sources), 2, 350)
+    for k in range(len(ToyModel.sources)):
+        assert torch.allclose(out[0, k], mix, atol=1e-5)
+
+def test_apply_vectorized_bag():
+    try:
+        from demucs.apply import BagOfModels
+    except ImportError:
+        return  # demucs not installed; the toy test above still covers us
+    from vectorized import apply_vectorized
+
+    bag = BagOfModels([ToyModel().eval()])
+    mix = torch.randn(2, 220)
+    out = apply_vectorized(bag, mix, max_sz=4)
+
+    assert out.shape == (1, len(ToyModel.sources), 2, 220)
+    assert torch.allclose(out[0, 0], mix, atol=1e-5)
+
+def test_separate_stems():
+    if os.environ.get("RUN_FULL_SMOKE") != "1":
+        return  # needs the real model weights
+    import soundfile as sf
+    import app
+
+    sr = 44100
+    t = np.arange(2 * sr, dtype=np.float32) / sr
+    audio = 0.5 * np.sin(2 * np.pi * 440 * t)
+    buf = io.BytesIO()
+    sf.write(buf, audio, sr, format="WAV")
+
+    stems, wav = app.separate_stems(buf.getvalue())
+
+    assert stems.shape[0] == len(app.MODEL.sources)
+    assert stems.shape[-1] == wav.shape[-1]
+
+if __name__ == "__main__":
+    test_apply_vectorized_shapes()
+    test_apply_vectorized_bag()
+    test_separate_stems()
+    print("SUCCESS: pipeline smoke tests passed")